@@ -1,37 +1,138 @@
+import argparse
+import hashlib
+import io
+import os
 import re
+import sys
+import zipfile
+from collections import Counter
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import suppress
+from itertools import islice, repeat
 from pathlib import Path
+from typing import BinaryIO
 
+import numpy as np
 import pandas as pd
-import pdfplumber
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pymupdf
+
+
+# ==============================
+# Regex patterns
+# ==============================
+
+_FEDEX_RE = re.compile(r"^(\d{9,})\s+(\d{2}/\d{2}/\d{4}).*(?<!\d)(\d+\.\d+)")
+
+# The Evri row pattern runs over whole pages, one match per line. It starts
+# with the newline that opens its line (the parser prefixes each page with
+# one), a literal prefix the regex engine can skip ahead to, and uses
+# [^\S\n] (whitespace other than newline) so a match never spans two lines
+_EVRI_RE = re.compile(
+    r"\n(?=[^\n.]*\.)[^\S\n]*(.+?)[^\S\n]+([\d,]+)[^\S\n]+(\d+\.\d+)[^\S\n]+[A-Z][^\S\n]+([\d,]+\.\d+)"
+)
+_EVRI_DESPATCH_RE = re.compile(
+    r"^(?!.*(?:Return|Repackaged)).*(?:Despatch|Parcel|Packet)", re.IGNORECASE
+)
+_EVRI_FUEL_RE = re.compile(r"Fuel", re.IGNORECASE)
+
+# Evri row buckets, indexed by the ids classify_evri assigns
+_EVRI_BUCKETS = ("excluded", "despatch", "extras")
+
+# Words whose baselines are within this many points share a text line
+_LINE_Y_TOLERANCE = 3.0
+
+# Part of the parse cache key; bump it when parser output changes
+_PARSE_CACHE_VERSION = 1
+
+# PDFs up to this size are parsed from an in-memory copy
+_IN_MEMORY_PDF_LIMIT = 100 * 1024 * 1024
 
 
 # ==============================
 # PDF text extraction
 # ==============================
 
-def extract_text_from_pdf(pdf_path: Path) -> str:
+def open_pdf(pdf: Path | bytes) -> pymupdf.Document:
     """
-    Read all pages of a PDF and return the text as one string.
+    Open a PDF with PyMuPDF, from its path or from bytes already read.
+
+    Files up to _IN_MEMORY_PDF_LIMIT are read into memory in one call and
+    parsed from there. Larger files are left to MuPDF's own buffered file
+    access to bound memory.
     """
-    text = ""
-    with pdfplumber.open(str(pdf_path)) as pdf:
-        for page in pdf.pages:
-            page_text = page.extract_text()
+    if isinstance(pdf, bytes):
+        return pymupdf.open(stream=pdf, filetype="pdf")
+    if pdf.stat().st_size <= _IN_MEMORY_PDF_LIMIT:
+        return pymupdf.open(stream=pdf.read_bytes(), filetype="pdf")
+    return pymupdf.open(pdf)
+
+
+def iter_page_lines(page: pymupdf.Page) -> Iterator[str]:
+    """
+    Yield the text lines of one PDF page, rebuilt from its words.
+
+    PyMuPDF's plain text output puts every table cell on its own line,
+    so words are grouped by baseline and read left to right instead.
+    This gives the one-row-per-line layout the parser regexes expect.
+    """
+    words = sorted(page.get_text("words"), key=lambda word: (word[3], word[0]))
+
+    line_words = []
+    line_y = 0.0
+
+    for x0, _, _, y1, text, *_ in words:
+        if line_words and y1 - line_y > _LINE_Y_TOLERANCE:
+            yield " ".join(word_text for _, word_text in sorted(line_words))
+            line_words = []
+
+        if not line_words:
+            line_y = y1
+
+        line_words.append((x0, text))
+
+    if line_words:
+        yield " ".join(word_text for _, word_text in sorted(line_words))
+
+
+def iter_pdf_pages(pdf: Path | bytes) -> Iterator[str]:
+    """
+    Yield the text of a PDF one page at a time, as newline-joined lines.
+
+    Text comes from MuPDF's C extractor through PyMuPDF. Pages are
+    streamed straight into the parsers, so only one page of text is held
+    at a time. Pages without any text are skipped.
+    """
+    with open_pdf(pdf) as doc:
+        for page in doc:
+            page_text = "\n".join(iter_page_lines(page))
             if page_text:
-                text += page_text + "\n"
-    return text
+                yield page_text
+
+
+def iter_pdf_lines(pdf_path: Path) -> Iterator[str]:
+    """
+    Yield the text lines of a PDF.
+
+    Built on iter_pdf_pages, so line positions match the line_idx values
+    the parsers record.
+    """
+    for page_text in iter_pdf_pages(pdf_path):
+        yield from page_text.split("\n")
 
 
 # ==============================
 # FedEx parser
 # ==============================
 
-def parse_fedex(text: str) -> pd.DataFrame:
+def parse_fedex(pages: Iterable[str], include_raw: bool = False) -> pd.DataFrame:
     """
     Extract shipment lines from FedEx PDFs.
 
     Logic:
-      - Read the PDF text line by line.
+      - Read the PDF text line by line, a page at a time.
       - Identify lines that look like a shipment row.
         Example:
             <shipment_number> <date_dd/mm/yyyy> FedEx Priority ... <values>
@@ -39,45 +140,61 @@ def parse_fedex(text: str) -> pd.DataFrame:
           shipment_number
           shipment_date (string)
           charge (last decimal number on the line)
+          line_idx (position of the line in the PDF text)
+          raw_line (only when include_raw is set)
 
     Regex pattern:
       - ^(\\d{9,}) matches a long shipment number at the start of the line.
       - (\\d{2}/\\d{2}/\\d{4}) captures dates like 13/10/2025.
-      - \\d+\\.\\d+ finds decimal values such as 2.99 or 17.10.
-        The last decimal on the line is treated as the total charge.
+      - .*(?<!\\d)(\\d+\\.\\d+) captures the last decimal value on the
+        line, such as 2.99. It is treated as the total charge.
+        The greedy .* backtracks from the end of the line, and the
+        lookbehind stops it from capturing only the tail of a number.
+      - Header and charge come out of one match, so each line is
+        scanned once.
     """
 
-    rows = []
-    pattern = r"^(\d{9,})\s+(\d{2}/\d{2}/\d{4})"
+    shipment_numbers, shipment_dates, charge_strs = [], [], []
+    line_idxs, raw_lines = [], []
 
-    for line in text.splitlines():
-        m = re.match(pattern, line)
-        if not m:
-            continue
-
-        shipment_number = m.group(1)
-        shipment_date = m.group(2)
+    lines = (line for page_text in pages for line in page_text.split("\n"))
 
-        nums = re.findall(r"\d+\.\d+", line)
-        if not nums:
+    for line_idx, line in enumerate(lines):
+        # Cheap reject before the regex: rows start with the shipment number
+        if not line[:1].isdigit():
             continue
 
-        charge = float(nums[-1])
+        m = _FEDEX_RE.match(line)
+        if not m:
+            continue
 
-        rows.append(
-            {
-                "shipment_number": shipment_number,
-                "shipment_date": shipment_date,
-                "charge": charge,
-                "raw_line": line,
-            }
-        )
+        shipment_number, shipment_date, charge_str = m.groups()
+
+        shipment_numbers.append(shipment_number)
+        shipment_dates.append(shipment_date)
+        charge_strs.append(charge_str)
+        line_idxs.append(line_idx)
+        if include_raw:
+            raw_lines.append(line)
+
+    df = pd.DataFrame(
+        {
+            "shipment_number": shipment_numbers,
+            "shipment_date": pd.array(shipment_dates, dtype="string"),
+            # numpy parses all charge strings in a single call
+            "charge": np.array(charge_strs, dtype=np.float64),
+            "line_idx": np.array(line_idxs, dtype=np.int32),
+        }
+    )
 
-    df = pd.DataFrame(rows)
+    if include_raw:
+        df["raw_line"] = raw_lines
 
     if not df.empty:
+        # An invoice repeats the same few dates, so let pandas parse each
+        # distinct string once and reuse the result
         df["shipment_date_parsed"] = pd.to_datetime(
-            df["shipment_date"], format="%d/%m/%Y", errors="coerce"
+            df["shipment_date"], format="%d/%m/%Y", errors="coerce", cache=True
         )
 
     return df
@@ -87,13 +204,20 @@ def parse_fedex(text: str) -> pd.DataFrame:
 # Evri parser
 # ==============================
 
-def parse_evri(text: str) -> pd.DataFrame:
+def matched_line(text: str, m: re.Match) -> str:
+    """Return the full line of text a row regex match starts on."""
+    end = text.find("\n", m.end())
+    return text[m.start() + 1:end] if end != -1 else text[m.start() + 1:]
+
+
+def parse_evri(pages: Iterable[str], include_raw: bool = False) -> pd.DataFrame:
     """
     Extract despatch service lines from Evri PDFs.
 
     Logic:
-      - Read the PDF text line by line.
-      - Identify lines that follow the Evri numeric pattern:
+      - Take the PDF text a page at a time and scan each page once with
+        the row regex.
+      - Keep lines that follow the Evri numeric pattern:
             <service text> <quantity> <unit_price> <VAT_code> <line_value>
         Example:
             Scottish Highlands & Islands Parcel 36 5.28 S 190.08
@@ -102,9 +226,12 @@ def parse_evri(text: str) -> pd.DataFrame:
           quantity
           price (unit price)
           value (line total)
+          raw_line (only when include_raw is set)
 
     Regex pattern:
-      - ^\\s*        leading spaces.
+      - \\n           line start.
+      - (?=[^\\n.]*\\.)  cheap reject: every row carries a decimal point.
+      - [^\\S\\n]*   leading spaces.
       - (.+?)        service name, non greedy, up to first numeric block.
       - ([\\d,]+)    quantity, may contain commas.
       - (\\d+\\.\\d+)  unit price.
@@ -112,76 +239,258 @@ def parse_evri(text: str) -> pd.DataFrame:
       - ([\\d,]+\\.\\d+)  line total value.
     """
 
-    rows = []
-    pattern = r"^\s*(.+?)\s+([\d,]+)\s+(\d+\.\d+)\s+[A-Z]\s+([\d,]+\.\d+)"
+    rows, raw_lines = [], []
 
-    for line in text.splitlines():
-        match = re.match(pattern, line)
-        if not match:
-            continue
+    for page_text in pages:
+        text = "\n" + page_text
+        for m in _EVRI_RE.finditer(text):
+            rows.append(m.groups())
+            if include_raw:
+                raw_lines.append(matched_line(text, m))
+
+    evri_df = pd.DataFrame(
+        rows, columns=["service", "quantity", "price", "value"], dtype="string"
+    )
+
+    # Service names repeat across rows, so store them as a category;
+    # quantities fit comfortably in int32
+    evri_df["service"] = evri_df["service"].str.strip().astype("category")
+    evri_df["quantity"] = (
+        evri_df["quantity"].str.replace(",", "", regex=False).astype("int32")
+    )
+    evri_df["price"] = evri_df["price"].astype("float64")
+    evri_df["value"] = (
+        evri_df["value"].str.replace(",", "", regex=False).astype("float64")
+    )
+
+    if include_raw:
+        evri_df["raw_line"] = raw_lines
+
+    return evri_df
+
+
+# ==============================
+# PDF loading
+# ==============================
+
+def cached_parse(
+    pdf_path: Path,
+    parser: Callable[[Iterable[str], bool], pd.DataFrame],
+    cache_dir: Path,
+    include_raw: bool = False,
+) -> pd.DataFrame:
+    """
+    Parse a PDF with the given parser, reusing a cached result if present.
+
+    Parsed frames are stored as Parquet files keyed by a BLAKE2 hash of
+    the PDF bytes plus the parser, its options, the PyMuPDF version and
+    _PARSE_CACHE_VERSION. A repeat run on the same invoices skips both
+    extraction and parsing.
+    """
+    if pdf_path.stat().st_size <= _IN_MEMORY_PDF_LIMIT:
+        # Read the file once: the same bytes are hashed and, on a cache
+        # miss, handed to the extractor
+        pdf = pdf_path.read_bytes()
+        digest = hashlib.blake2b(pdf, digest_size=16)
+    else:
+        # Hash large files in chunks and let MuPDF read them from disk
+        pdf = pdf_path
+        digest = hashlib.blake2b(digest_size=16)
+        with pdf_path.open("rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+
+    digest.update(
+        f"|{parser.__name__}|{include_raw}|{pymupdf.VersionBind}"
+        f"|{_PARSE_CACHE_VERSION}".encode()
+    )
+    cache_file = cache_dir / f"{digest.hexdigest()}.parquet"
+
+    # The cache only saves time: an unreadable entry is parsed again, and
+    # a failed write leaves the run to carry on without caching
+    if cache_file.exists():
+        try:
+            return pd.read_parquet(cache_file)
+        except (OSError, ValueError):
+            pass
+
+    df = parser(iter_pdf_pages(pdf), include_raw)
+
+    # Write under a per-process name and rename, so workers parsing the
+    # same file never see a half-written entry
+    tmp_file = cache_file.with_suffix(f".{os.getpid()}.tmp")
+    try:
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        df.to_parquet(tmp_file, index=False)
+        tmp_file.replace(cache_file)
+    except OSError:
+        with suppress(OSError):
+            tmp_file.unlink(missing_ok=True)
+
+    return df
+
+
+def load_fedex_pdf(
+    pdf_path: Path, cache_dir: Path, include_raw: bool = False
+) -> pd.DataFrame:
+    """
+    Extract and parse one FedEx PDF.
+
+    Defined at module level so it can run in a worker process.
+    """
+    return cached_parse(pdf_path, parse_fedex, cache_dir, include_raw)
+
+
+def load_evri_pdf(
+    pdf_path: Path, cache_dir: Path, include_raw: bool = False
+) -> pd.DataFrame:
+    """
+    Extract and parse one Evri PDF.
+
+    Defined at module level so it can run in a worker process.
+    """
+    return cached_parse(pdf_path, parse_evri, cache_dir, include_raw)
+
+
+def source_file_labels(pdf_paths: list[Path]) -> list[str]:
+    """
+    Return the source_file label for each PDF path.
+
+    The label is the file name, unless different files share that name;
+    those keep the path as entered, so every file gets its own label.
+    """
+    name_counts = Counter(pdf_path.name for pdf_path in set(pdf_paths))
+    return [
+        pdf_path.name if name_counts[pdf_path.name] == 1 else str(pdf_path)
+        for pdf_path in pdf_paths
+    ]
+
+
+def concat_pdf_frames(
+    frames: Iterable[pd.DataFrame], pdf_paths: list[Path]
+) -> pd.DataFrame:
+    """
+    Concatenate per-file frames and tag each row with its source file.
+
+    source_file is built once as a categorical over all file labels, from
+    integer codes, rather than as a repeated string column per frame.
+    Per-frame categoricals would not help: concat turns categoricals
+    with differing categories back into plain strings. For the same
+    reason, parser columns that are categorical in any frame, such as
+    Evri service, are turned back into categoricals after the concat.
+    """
+    frames = list(frames)
+    df = pd.concat(frames, ignore_index=True)
+
+    for column in df.columns:
+        if any(
+            isinstance(frame.dtypes.get(column), pd.CategoricalDtype)
+            for frame in frames
+        ):
+            df[column] = df[column].astype("category")
 
-        service = match.group(1).strip()
-        quantity = int(match.group(2).replace(",", ""))
-        price = float(match.group(3))
-        value = float(match.group(4).replace(",", ""))
-
-        rows.append(
-            {
-                "service": service,
-                "quantity": quantity,
-                "price": price,
-                "value": value,
-                "raw_line": line,
-            }
+    labels = source_file_labels(pdf_paths)
+    categories = list(dict.fromkeys(labels))
+    label_codes = [categories.index(label) for label in labels]
+
+    codes = np.repeat(label_codes, [len(frame) for frame in frames])
+    df["source_file"] = pd.Categorical.from_codes(codes, categories=categories)
+
+    return df
+
+
+def attach_fedex_raw_lines(
+    fedex_rows: pd.DataFrame, pdf_paths: list[Path]
+) -> pd.DataFrame:
+    """
+    Return FedEx rows with their original PDF line added as raw_line.
+
+    Lines are looked up by line_idx, re-reading only the files the rows
+    came from and only up to the last line wanted. Meant for small
+    selections such as anomalies.
+    """
+    fedex_rows = fedex_rows.copy()
+    raw_lines = pd.Series(pd.NA, index=fedex_rows.index, dtype="string")
+
+    # source_file labels are unique per file, unlike bare file names
+    paths_by_label = dict(zip(source_file_labels(pdf_paths), pdf_paths))
+
+    for source_file, group in fedex_rows.groupby("source_file", observed=True):
+        # Several rows can share a line_idx when a file is listed twice,
+        # so collect the lines first and then map them onto every row
+        wanted = set(group["line_idx"])
+        pdf_lines = islice(
+            iter_pdf_lines(paths_by_label[source_file]), group["line_idx"].max() + 1
         )
+        lines = {
+            line_idx: line
+            for line_idx, line in enumerate(pdf_lines)
+            if line_idx in wanted
+        }
+        raw_lines.loc[group.index] = group["line_idx"].map(lines).to_numpy()
 
-    return pd.DataFrame(rows)
+    # Same position parse_fedex gives raw_line, so the schema does not
+    # depend on --debug
+    fedex_rows.insert(
+        fedex_rows.columns.get_loc("line_idx") + 1, "raw_line", raw_lines
+    )
+    return fedex_rows
 
 
 # ==============================
 # Evri cleaning and splitting
 # ==============================
 
-def clean_evri(evri_df: pd.DataFrame) -> tuple[pd.DataFrame, pd.DataFrame]:
+def _category_mask(series: pd.Series, pattern: re.Pattern) -> np.ndarray:
     """
-    Split Evri rows into:
-      - core rows with value > 0 (real charge lines)
-      - excluded rows with value == 0 (headers and meta lines)
+    Return a row mask of the values in series that match pattern.
+
+    The regex runs once per distinct value and is broadcast to the rows
+    through the categorical codes.
     """
-    evri_core = evri_df[evri_df["value"] > 0].copy()
-    evri_excluded = evri_df[evri_df["value"] == 0].copy()
-    return evri_core, evri_excluded
+    values = series.astype("category")
 
+    # The trailing False is picked up by the -1 code of missing values
+    category_hits = values.cat.categories.str.contains(pattern)
+    category_hits = np.append(np.asarray(category_hits, dtype=bool), False)
 
-def split_evri_core(evri_core: pd.DataFrame) -> tuple[pd.DataFrame, pd.DataFrame]:
+    return category_hits[values.cat.codes.to_numpy()]
+
+
+def classify_evri(evri_df: pd.DataFrame) -> dict[str, pd.DataFrame]:
     """
-    Split Evri core rows into:
-      - despatch_rows: outbound ecommerce despatch services
-      - extra_rows: returns, SMS/ETA, relabelling, surcharges, repackaged etc.
+    Split Evri rows in a single pass into:
+      - excluded: rows with value == 0 (headers and meta lines)
+      - despatch: outbound ecommerce despatch services with value > 0
+      - extras: other rows with value > 0, such as returns, SMS/ETA,
+        relabelling, surcharges and repackaged parcels
 
     Logic:
       - Outbound rows usually contain Despatch, Parcel or Packet.
       - Exclude lines where the name also contains Return.
       - Exclude 'Repackaged' so it is treated as an extra handling charge.
+      - All three rules live in one case-insensitive regex, applied to
+        the distinct service names only and broadcast to the rows.
+      - Every row gets one bucket id, and each bucket is then selected
+        with one positional lookup.
     """
 
-    # Anything that looks like an outbound movement
-    despatch_like_mask = (
-        evri_core["service"].str.contains("Despatch", case=False, na=False)
-        | evri_core["service"].str.contains("Parcel", case=False, na=False)
-        | evri_core["service"].str.contains("Packet", case=False, na=False)
-    )
+    values = evri_df["value"].to_numpy()
 
-    # Returns are separate flows
-    return_mask = evri_core["service"].str.contains("Return", case=False, na=False)
+    # Outbound movement, not a return and not a repackaging charge
+    despatch_mask = _category_mask(evri_df["service"], _EVRI_DESPATCH_RE)
 
-    # Parcel Repackaged is an extra handling service, not a base despatch
-    repack_mask = evri_core["service"].str.contains("Repackaged", case=False, na=False)
-
-    despatch_rows = evri_core[despatch_like_mask & ~return_mask & ~repack_mask].copy()
-    extra_rows = evri_core[~(despatch_like_mask & ~return_mask & ~repack_mask)].copy()
+    # Bucket ids follow _EVRI_BUCKETS; negative values fall in none of them
+    bucket_ids = np.where(
+        values > 0,
+        np.where(despatch_mask, 1, 2),
+        np.where(values == 0, 0, -1),
+    )
 
-    return despatch_rows, extra_rows
+    return {
+        bucket: evri_df.iloc[bucket_ids == bucket_id].copy()
+        for bucket_id, bucket in enumerate(_EVRI_BUCKETS)
+    }
 
 
 
@@ -206,7 +515,9 @@ def compute_fedex_metrics(fedex_df: pd.DataFrame, fixed_rate: float) -> dict:
             "status": "No data",
         }
 
-    spend = round(fedex_df["charge"].sum(), 3)
+    # Reduce the bare ndarray; charges are never NaN, so pandas' missing
+    # value handling is not needed
+    spend = round(float(fedex_df["charge"].to_numpy().sum()), 3)
     avg_cost = round(spend / despatches, 3)
     variance = round(avg_cost - fixed_rate, 3)
     total_difference = round(variance * despatches, 3)
@@ -232,16 +543,17 @@ def get_evri_fuel_total(evri_extras: pd.DataFrame) -> float:
     Return the total fuel surcharge from Evri extras.
 
     Looks for lines that contain the word 'Fuel' in the service name.
+    Rows are picked with a category mask, so no filtered frame is built.
     """
-    fuel_rows = evri_extras[evri_extras["service"].str.contains("Fuel", case=False, na=False)]
-    return round(fuel_rows["value"].sum(), 3)
+    fuel_mask = _category_mask(evri_extras["service"], _EVRI_FUEL_RE)
+    return round(float(evri_extras["value"].to_numpy()[fuel_mask].sum()), 3)
 
 def compute_evri_metrics(evri_despatch: pd.DataFrame, fixed_rate: float, fuel_total: float = 0.0) -> dict:
     """
     Compute Evri metrics using outbound despatch rows only.
     """
 
-    despatches = int(evri_despatch["quantity"].sum())
+    despatches = int(evri_despatch["quantity"].to_numpy().sum())
 
     if despatches == 0:
         return {
@@ -253,7 +565,7 @@ def compute_evri_metrics(evri_despatch: pd.DataFrame, fixed_rate: float, fuel_to
             "status": "No data",
         }
 
-    base_spend = evri_despatch["value"].sum()
+    base_spend = float(evri_despatch["value"].to_numpy().sum())
     spend = round(base_spend + fuel_total, 3)
 
     avg_cost = round(spend / despatches, 3)
@@ -278,11 +590,116 @@ def compute_evri_metrics(evri_despatch: pd.DataFrame, fixed_rate: float, fuel_to
 
 
 
+# ==============================
+# Output helpers
+# ==============================
+
+def fast_to_csv(df: pd.DataFrame, path: Path | BinaryIO) -> None:
+    """
+    Write a DataFrame to CSV with Arrow's multi-threaded C++ writer.
+
+    path can also be an open binary file, such as an in-memory buffer.
+
+    Timestamp columns that hold plain dates, such as parsed invoice
+    dates, are written as dates like pandas does. A column where any
+    value carries a time of day is written as full timestamps instead.
+    Unlike pandas, Arrow quotes every string value.
+
+    Money columns stay float64 and are written at full precision. Arrow
+    formats numbers in C, so downcasting to float32 or rounding to fewer
+    digits would save no Python work and would only lose pennies.
+    """
+    table = pa.Table.from_pandas(df, preserve_index=False)
+
+    for i, field in enumerate(table.schema):
+        if pa.types.is_timestamp(field.type):
+            column = table.column(i)
+            dates = column.cast(pa.date32())
+            # The date32 cast silently drops any time of day, so only use
+            # it when converting back gives the original values
+            if dates.cast(field.type).equals(column):
+                table = table.set_column(i, field.name, dates)
+
+    pacsv.write_csv(table, path)
+
+
+def write_output_zip(
+    zip_path: Path,
+    summary: pd.DataFrame,
+    row_outputs: dict[str, pd.DataFrame],
+    parquet_outputs: dict[str, pd.DataFrame],
+) -> None:
+    """
+    Write every output into one zip archive instead of loose files.
+
+    The archive holds the same entries as the output folder: each CSV
+    plus the zstd Parquet copies listed in parquet_outputs. CSVs are
+    deflated at a low level for speed; Parquet files are already
+    compressed, so they are stored.
+    """
+    with zipfile.ZipFile(
+        zip_path, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=3
+    ) as bundle:
+        bundle.writestr(
+            "summary_for_dashboard.csv", summary.to_csv(index=False).encode()
+        )
+
+        for name, df in row_outputs.items():
+            buffer = io.BytesIO()
+            fast_to_csv(df, buffer)
+            bundle.writestr(name, buffer.getvalue())
+
+        for name, df in parquet_outputs.items():
+            bundle.writestr(
+                Path(name).with_suffix(".parquet").name,
+                df.to_parquet(engine="pyarrow", compression="zstd", index=False),
+                compress_type=zipfile.ZIP_STORED,
+            )
+
+
+def format_carrier_report(title: str, metrics: dict, fixed_rate: float) -> str:
+    """
+    Return one carrier's block of the CLI report as a single string.
+
+    Each metric is formatted once, in one f-string per line.
+    """
+    total_diff = metrics["total_difference"]
+    impact_word = "saving" if total_diff < 0 else "overspend"
+
+    return "".join(
+        [
+            f"{title}\n",
+            f"  Despatches          : {metrics['despatches']:,}\n",
+            f"  Total spend         : £{metrics['spend']:.3f}\n",
+            f"  Fixed rate          : £{fixed_rate:.2f} per despatch\n",
+            f"  Actual average      : £{metrics['avg_cost']:.3f} per despatch\n",
+            f"  Variance per unit   : £{metrics['variance']:.3f}\n",
+            f"  Total {impact_word:<9}: £{abs(total_diff):.2f} vs fixed rate\n\n",
+        ]
+    )
+
+
+
 # ==============================
 # Main
 # ==============================
 
 def main():
+    parser = argparse.ArgumentParser(
+        description="Compare FedEx and Evri invoice costs against fixed rates."
+    )
+    parser.add_argument(
+        "--debug",
+        action="store_true",
+        help="keep the raw PDF line on every parsed row",
+    )
+    parser.add_argument(
+        "--zip",
+        action="store_true",
+        help="bundle all outputs into results.zip instead of loose files",
+    )
+    args = parser.parse_args()
+
     print("=" * 60)
     print("LOGISTICS COST COMPARISON TOOL".center(60))
     print("=" * 60)
@@ -304,6 +721,17 @@ def main():
         print("No FedEx files provided. Exiting.")
         return
 
+    # Check every FedEx file up front, before more prompts or any parsing
+    fedex_paths = [Path(fedex_path) for fedex_path in fedex_files]
+    missing = [pdf_path for pdf_path in fedex_paths if not pdf_path.exists()]
+
+    if missing:
+        print("\nFedEx files not found:")
+        for pdf_path in missing:
+            print(f"  - {pdf_path}")
+        print("Exiting.")
+        return
+
     # Ask for Evri file names
     evri_input = input(
         "\nEnter Evri PDF file names separated by commas\n"
@@ -316,6 +744,17 @@ def main():
         print("No Evri files provided. Exiting.")
         return
 
+    # Check every Evri file up front, before the output folder is created
+    evri_paths = [Path(evri_path) for evri_path in evri_files]
+    missing = [pdf_path for pdf_path in evri_paths if not pdf_path.exists()]
+
+    if missing:
+        print("\nEvri files not found:")
+        for pdf_path in missing:
+            print(f"  - {pdf_path}")
+        print("Exiting.")
+        return
+
     # Ask for output folder
     outdir_input = input(
         "\nEnter output folder name (press Enter to use 'output'):\n> "
@@ -327,59 +766,37 @@ def main():
     outdir = Path(outdir_input)
     outdir.mkdir(parents=True, exist_ok=True)
 
+    # Parsed invoices are cached here so repeat runs skip extraction
+    cache_dir = Path(os.environ.get("PDF_CACHE", ".pdf_cache"))
+
     # Fixed rates
     fixed_rate_fedex = 3.10
     fixed_rate_evri = 2.44
 
     # ==============================
-    # FedEx: load all files
-    # ==============================
-
-    fedex_frames = []
-
-    for fedex_path in fedex_files:
-        pdf_path = Path(fedex_path)
-        if not pdf_path.exists():
-            print(f"\nWarning: FedEx file not found: {pdf_path}")
-            continue
-
-        text = extract_text_from_pdf(pdf_path)
-        df = parse_fedex(text)
-        df["source_file"] = pdf_path.name
-        fedex_frames.append(df)
-
-    if fedex_frames:
-        fedex_df = pd.concat(fedex_frames, ignore_index=True)
-    else:
-        print("\nNo valid FedEx data was loaded. Exiting.")
-        return
-
-    # ==============================
-    # Evri: load all files
+    # Load all files in parallel
     # ==============================
 
-    evri_frames = []
-
-    for evri_path in evri_files:
-        pdf_path = Path(evri_path)
-        if not pdf_path.exists():
-            print(f"\nWarning: Evri file not found: {pdf_path}")
-            continue
+    # One process per PDF, capped at the core count; FedEx and Evri
+    # files share the same pool
+    max_workers = min(len(fedex_paths) + len(evri_paths), os.cpu_count() or 1)
 
-        text = extract_text_from_pdf(pdf_path)
-        df = parse_evri(text)
-        df["source_file"] = pdf_path.name
-        evri_frames.append(df)
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        fedex_jobs = executor.map(
+            load_fedex_pdf, fedex_paths, repeat(cache_dir), repeat(args.debug)
+        )
+        evri_jobs = executor.map(
+            load_evri_pdf, evri_paths, repeat(cache_dir), repeat(args.debug)
+        )
 
-    if evri_frames:
-        evri_df = pd.concat(evri_frames, ignore_index=True)
-    else:
-        print("\nNo valid Evri data was loaded. Exiting.")
-        return
+        fedex_df = concat_pdf_frames(fedex_jobs, fedex_paths)
+        evri_df = concat_pdf_frames(evri_jobs, evri_paths)
 
     # Cleaning and splitting
-    evri_core, evri_excluded = clean_evri(evri_df)
-    evri_despatch, evri_extras = split_evri_core(evri_core)
+    evri_buckets = classify_evri(evri_df)
+    evri_despatch = evri_buckets["despatch"]
+    evri_extras = evri_buckets["extras"]
+    evri_excluded = evri_buckets["excluded"]
 
     # Fuel from Evri extras
     evri_fuel_total = get_evri_fuel_total(evri_extras)
@@ -392,83 +809,113 @@ def main():
         fuel_total=evri_fuel_total,
     )
 
-    # Summary dataframe
+    # Summary dataframe, one row per carrier. Columns are built as typed
+    # arrays so pandas has no per-row dicts to infer dtypes from.
     summary = pd.DataFrame(
-        [
-            {
-                "carrier": "FedEx",
-                "despatches": fedex_metrics["despatches"],
-                "spend": fedex_metrics["spend"],
-                "avg_cost_per_despatch": fedex_metrics["avg_cost"],
-                "fixed_rate": fixed_rate_fedex,
-                "variance_per_despatch": fedex_metrics["variance"],
-                "total_difference": fedex_metrics["total_difference"],
-                "status": fedex_metrics["status"],
-            },
-            {
-                "carrier": "Evri outbound",
-                "despatches": evri_metrics["despatches"],
-                "spend": evri_metrics["spend"],
-                "avg_cost_per_despatch": evri_metrics["avg_cost"],
-                "fixed_rate": fixed_rate_evri,
-                "variance_per_despatch": evri_metrics["variance"],
-                "total_difference": evri_metrics["total_difference"],
-                "status": evri_metrics["status"],
-            },
-        ]
+        {
+            "carrier": pd.array(["FedEx", "Evri outbound"], dtype="string"),
+            "despatches": np.array(
+                [fedex_metrics["despatches"], evri_metrics["despatches"]],
+                dtype=np.int64,
+            ),
+            "spend": np.array(
+                [fedex_metrics["spend"], evri_metrics["spend"]], dtype=np.float64
+            ),
+            "avg_cost_per_despatch": np.array(
+                [fedex_metrics["avg_cost"], evri_metrics["avg_cost"]],
+                dtype=np.float64,
+            ),
+            "fixed_rate": np.array(
+                [fixed_rate_fedex, fixed_rate_evri], dtype=np.float64
+            ),
+            "variance_per_despatch": np.array(
+                [fedex_metrics["variance"], evri_metrics["variance"]],
+                dtype=np.float64,
+            ),
+            "total_difference": np.array(
+                [fedex_metrics["total_difference"], evri_metrics["total_difference"]],
+                dtype=np.float64,
+            ),
+            "status": pd.array(
+                [fedex_metrics["status"], evri_metrics["status"]], dtype="string"
+            ),
+        }
     )
 
-    # Simple FedEx anomalies: zero or negative charges
-    fedex_anomalies = fedex_df[fedex_df["charge"] <= 0].copy()
+    # Simple FedEx anomalies: zero or negative charges. The selection is
+    # only written out, never mutated, so it needs no defensive copy.
+    anomaly_mask = fedex_df["charge"].to_numpy() <= 0
+    fedex_anomalies = fedex_df.iloc[anomaly_mask]
+
+    # Anomalies always carry their raw line; look it up when parsing skipped it
+    if not args.debug:
+        fedex_anomalies = attach_fedex_raw_lines(fedex_anomalies, fedex_paths)
+
+    # Row-level outputs, written with the Arrow CSV writer and as Parquet
+    row_outputs = {
+        "fedex_cleaned.csv": fedex_df,
+        "fedex_anomalies.csv": fedex_anomalies,
+        "evri_despatch.csv": evri_despatch,
+        "evri_extras.csv": evri_extras,
+        "evri_excluded_zero_value.csv": evri_excluded,
+    }
+
+    # Save CSVs and typed zstd Parquet copies for analysts, either as one
+    # zip archive or as loose files. Loose writes are independent, so
+    # they are overlapped in threads.
+    parquet_outputs = {"summary_for_dashboard.csv": summary, **row_outputs}
 
-    # Save CSVs
-    summary.to_csv(outdir / "summary_for_dashboard.csv", index=False)
-    fedex_df.to_csv(outdir / "fedex_cleaned.csv", index=False)
-    fedex_anomalies.to_csv(outdir / "fedex_anomalies.csv", index=False)
-    evri_despatch.to_csv(outdir / "evri_despatch.csv", index=False)
-    evri_extras.to_csv(outdir / "evri_extras.csv", index=False)
-    evri_excluded.to_csv(outdir / "evri_excluded_zero_value.csv", index=False)
+    if args.zip:
+        written_to = outdir / "results.zip"
+        write_output_zip(written_to, summary, row_outputs, parquet_outputs)
+    else:
+        written_to = outdir
+
+        with ThreadPoolExecutor(max_workers=len(row_outputs) + 1) as executor:
+            futures = [
+                executor.submit(
+                    summary.to_csv, outdir / "summary_for_dashboard.csv", index=False
+                )
+            ]
+            futures += [
+                executor.submit(fast_to_csv, df, outdir / name)
+                for name, df in row_outputs.items()
+            ]
+            futures += [
+                executor.submit(
+                    df.to_parquet,
+                    (outdir / name).with_suffix(".parquet"),
+                    engine="pyarrow",
+                    compression="zstd",
+                    index=False,
+                )
+                for name, df in parquet_outputs.items()
+            ]
+
+            # Re-raise any write error
+            for future in futures:
+                future.result()
 
     # ==============================
     # CLI report
     # ==============================
 
-    fedex_diff = fedex_metrics["total_difference"]
-    evri_diff = evri_metrics["total_difference"]
-
-    fedex_impact_word = "saving" if fedex_diff < 0 else "overspend"
-    evri_impact_word = "saving" if evri_diff < 0 else "overspend"
-
-    print(f"\n{'='*60}")
-    print("LOGISTICS COST COMPARISON REPORT".center(60))
-    print(f"{'='*60}\n")
-
-    print("FedEx Analysis")
-    print(f"  Despatches          : {fedex_metrics['despatches']:,}")
-    print(f"  Total spend         : £{fedex_metrics['spend']:.3f}")
-    print(f"  Fixed rate          : £{fixed_rate_fedex:.2f} per despatch")
-    print(f"  Actual average      : £{fedex_metrics['avg_cost']:.3f} per despatch")
-    print(f"  Variance per unit   : £{fedex_metrics['variance']:.3f}")
-    print(
-        f"  Total {fedex_impact_word:<9}: "
-        f"£{abs(fedex_diff):.2f} vs fixed rate\n"
-    )
-
-    print("Evri Outbound Analysis (including fuel)")
-    print(f"  Despatches          : {evri_metrics['despatches']:,}")
-    print(f"  Total spend         : £{evri_metrics['spend']:.3f}")
-    print(f"  Fixed rate          : £{fixed_rate_evri:.2f} per despatch")
-    print(f"  Actual average      : £{evri_metrics['avg_cost']:.3f} per despatch")
-    print(f"  Variance per unit   : £{evri_metrics['variance']:.3f}")
-    print(
-        f"  Total {evri_impact_word:<9}: "
-        f"£{abs(evri_diff):.2f} vs fixed rate\n"
-    )
-
-    print(f"{'-'*60}")
-    print("CSV files written to:")
-    print(f"  {outdir.resolve()}")
-    print(f"{'-'*60}\n")
+    # Build the whole report first and write it in one call
+    report = [
+        f"\n{'='*60}\n",
+        "LOGISTICS COST COMPARISON REPORT".center(60) + "\n",
+        f"{'='*60}\n\n",
+        format_carrier_report("FedEx Analysis", fedex_metrics, fixed_rate_fedex),
+        format_carrier_report(
+            "Evri Outbound Analysis (including fuel)", evri_metrics, fixed_rate_evri
+        ),
+        f"{'-'*60}\n",
+        "CSV and Parquet files written to:\n",
+        f"  {written_to.resolve()}\n",
+        f"{'-'*60}\n\n",
+    ]
+
+    sys.stdout.write("".join(report))
 
 
 